@@ -0,0 +1,37 @@
+"""
+Helpers shared by fetch_dvf.py and fetch_lepriximmo.py.
+Needs only the standard library (orjson is used when installed), so either script can import it.
+"""
+
+import json
+from typing import Dict, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional: much faster JSON output, falls back to json
+    orjson = None
+
+def parse_year_range(year_range: str) -> Tuple[int, int]:
+    """Parse year range string (e.g., '2020-2025') into tuple of integers."""
+    try:
+        if '-' in year_range:
+            parts = year_range.split('-')
+            if len(parts) == 2:
+                start_year = int(parts[0].strip())
+                end_year = int(parts[1].strip())
+                return start_year, end_year
+    except (ValueError, IndexError):
+        pass
+    
+    # Default to 2020-2025 if parsing fails
+    print(f"⚠ Invalid year range format '{year_range}', using default 2020-2025")
+    return 2020, 2025
+
+def save_json(data: Dict, path: str) -> None:
+    """Write data as indented UTF-8 JSON, using orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
@@ -3,18 +3,33 @@
 Fetch DVF (Demandes de Valeurs Foncières) data for Rue Brossolette, 92400 Courbevoie
 and calculate price per square meter for years 2020-2025.
 
+Usage: python3 fetch_dvf.py [YYYY-YYYY]   (default: 2020-2025, only those files are fetched)
+
 Note: This script downloads ~350MB of government data. First run may take 5-10 minutes.
 """
 
 import os
-import json
 import zipfile
 import io
+import hashlib
+import math
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import csv
-from typing import Dict, List
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from operator import itemgetter
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
 import random
+import sys
+import threading
+
+from common import parse_year_range, save_json
 
 # DVF dataset URLs from data.gouv.fr
 DVF_URLS = {
@@ -26,90 +41,292 @@ DVF_URLS = {
     "2025_H1": "https://www.data.gouv.fr/api/1/datasets/r/4d741143-8331-4b59-95c2-3b24a7bdbe3c",
 }
 
-def download_dvf_file(url: str, year: str) -> List[Dict]:
-    """Download and extract DVF ZIP file, return as list of dicts."""
-    print(f"Downloading DVF data for {year}... (this may take a few minutes)")
+# Downloaded DVF ZIPs are kept here; the yearly files on data.gouv.fr never change
+DVF_CACHE_DIR = Path(__file__).resolve().parent / "dvf_files"
+
+# One pooled keep-alive connection per yearly file, shared by the download workers
+MAX_DOWNLOAD_WORKERS = len(DVF_URLS)
+SESSION = requests.Session()
+SESSION.headers.update({'Accept-Encoding': 'gzip, deflate'})
+_adapter = HTTPAdapter(
+    pool_connections=MAX_DOWNLOAD_WORKERS,
+    pool_maxsize=MAX_DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+# Buffer size used to read lines out of the decompressed DVF entry
+READ_BUFFER_SIZE = 1 << 20
+
+# Amounts are stored in signed 64-bit array columns (see Transactions)
+MAX_DVF_AMOUNT = 2 ** 63
+
+# Download workers print concurrently; the lock keeps each message on its own line
+_PRINT_LOCK = threading.Lock()
+
+# Set on Ctrl-C so running downloads stop at their next chunk instead of finishing
+CANCEL_EVENT = threading.Event()
+
+class DownloadCancelled(Exception):
+    """Raised inside a download worker once CANCEL_EVENT is set."""
+
+# DVF columns kept from each row, in the order yielded by iter_dvf_rows
+# (process_transactions unpacks rows in this order)
+DVF_COLUMNS = (
+    'code_postal',
+    'adresse_nom_voie',
+    'adresse_numero',
+    'valeur_fonciere',
+    'surface_reelle_bati',
+    'date_mutation',
+    'type_local',
+)
+
+def select_dvf_urls(start_year: int, end_year: int) -> Dict[str, str]:
+    """Keep the DVF_URLS entries (e.g. '2020_H2') whose year is within the range."""
+    return {
+        year: url for year, url in DVF_URLS.items()
+        if start_year <= int(year.split('_')[0]) <= end_year
+    }
+
+@dataclass
+class Transactions:
+    """Transactions stored column-wise: one list or typed array per field."""
+    year: List[str] = field(default_factory=list)
+    date: List[Optional[str]] = field(default_factory=list)
+    address: List[str] = field(default_factory=list)
+    price: array = field(default_factory=lambda: array('q'))
+    surface_m2: array = field(default_factory=lambda: array('q'))
+    price_per_m2: array = field(default_factory=lambda: array('d'))
+    property_type: List[str] = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.year)
+    
+    def append(self, year: str, date: Optional[str], address: str, price: int,
+               surface_m2: int, price_per_m2: float, property_type: str) -> None:
+        """Add one transaction to every column."""
+        self.year.append(year)
+        self.date.append(date)
+        self.address.append(address)
+        self.price.append(price)
+        self.surface_m2.append(surface_m2)
+        self.price_per_m2.append(price_per_m2)
+        self.property_type.append(property_type)
+    
+    def extend(self, other: 'Transactions') -> None:
+        """Append all transactions of other, column by column."""
+        self.year.extend(other.year)
+        self.date.extend(other.date)
+        self.address.extend(other.address)
+        self.price.extend(other.price)
+        self.surface_m2.extend(other.surface_m2)
+        self.price_per_m2.extend(other.price_per_m2)
+        self.property_type.extend(other.property_type)
+    
+    def to_dicts(self) -> List[Dict]:
+        """Materialize one dict per transaction, for JSON output."""
+        return [
+            {
+                "year": year,
+                "date": date,
+                "address": address,
+                "price": price,
+                "surface_m2": surface_m2,
+                "price_per_m2": price_per_m2,
+                "property_type": property_type
+            }
+            for year, date, address, price, surface_m2, price_per_m2, property_type in zip(
+                self.year, self.date, self.address, self.price,
+                self.surface_m2, self.price_per_m2, self.property_type
+            )
+        ]
+
+def log(message: str) -> None:
+    """Print one message atomically, safe to call from the download workers."""
+    with _PRINT_LOCK:
+        print(message, flush=True)
+
+def fetch_dvf_zip(url: str, year: str) -> Path:
+    """Return the local DVF ZIP for url, downloading it only if not cached yet."""
+    cache_path = DVF_CACHE_DIR / f"{hashlib.sha1(url.encode()).hexdigest()[:16]}.zip"
+    if cache_path.exists() and zipfile.is_zipfile(cache_path):
+        log(f"Using cached DVF data for {year} ({cache_path.name})")
+        return cache_path
+    
+    log(f"Downloading DVF data for {year}... (this may take a few minutes)")
+    DVF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # Stream to a temporary name and rename once it is a valid ZIP, so an
+    # interrupted or bogus download never ends up in the cache
+    tmp_path = cache_path.with_suffix('.tmp')
     try:
-        response = requests.get(url, timeout=300, stream=True)
-        response.raise_for_status()
+        with SESSION.get(url, timeout=300, stream=True) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    if CANCEL_EVENT.is_set():
+                        raise DownloadCancelled(year)
+                    f.write(chunk)
         
-        # Extract ZIP file
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_ref:
-            # Find the .txt file in the ZIP
-            file_list = zip_ref.namelist()
-            txt_file = [f for f in file_list if f.endswith('.txt')][0]
-            
-            # Read the file with pipe delimiter
-            with zip_ref.open(txt_file) as f:
-                # Decode and parse CSV with pipe delimiter
-                text = f.read().decode('utf-8', errors='ignore')
-                lines = text.splitlines()
-                reader = csv.DictReader(lines, delimiter='|')
-                
-                # Process rows as we read them to save memory
-                result = []
-                for i, row in enumerate(reader):
-                    result.append(row)
-                    if (i + 1) % 500000 == 0:
-                        print(f"  - Processed {i + 1} rows...")
-                
-                print(f"  - Read {len(result)} total rows")
-                return result
-                
-    except requests.exceptions.RequestException as e:
-        print(f"Network error downloading {year}: {e}")
-        print(f"Please try again, or visit https://www.data.gouv.fr/datasets/demandes-de-valeurs-foncieres")
-        return []
-    except Exception as e:
-        print(f"Error processing {year}: {e}")
-        return []
+        # A 200 response can still be an HTML error page; never cache that
+        if not zipfile.is_zipfile(tmp_path):
+            raise zipfile.BadZipFile(f"downloaded file for {year} is not a ZIP archive")
+        os.replace(tmp_path, cache_path)
+    finally:
+        # Drop any partial download instead of leaving it next to the cache
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return cache_path
 
-def process_transactions(rows: List[Dict], year: str) -> List[Dict]:
-    """Filter and process transactions for Rue Brossolette, 92400."""
-    results = []
+def iter_candidate_lines(raw_file: IO[bytes], year: str) -> Iterator[str]:
+    """Yield decoded DVF lines that may concern Rue Brossolette, 92400."""
+    count = 0
+    for count, raw_line in enumerate(raw_file, 1):
+        if count % 500000 == 0:
+            if CANCEL_EVENT.is_set():
+                raise DownloadCancelled(year)
+            log(f"  - {year}: processed {count} rows...")
+        
+        # Cheap substring test on the undecoded line rejects almost every row.
+        # DVF street names are upper-case, so no per-line case folding is needed.
+        if b'92400' not in raw_line or b'BROSSOLETTE' not in raw_line:
+            continue
+        
+        yield raw_line.decode('utf-8', errors='ignore')
     
-    for row in rows:
-        try:
-            # Filter for postal code 92400 and street containing "BROSSOLETTE"
-            postal_code = row.get('code_postal', '').strip()
-            street = row.get('adresse_nom_voie', '').upper() if row.get('adresse_nom_voie') else ''
-            
-            if postal_code != '92400' or 'BROSSOLETTE' not in street:
-                continue
-            
-            # Get transaction details
-            valeur_str = row.get('valeur_fonciere', '').strip()
-            surface_str = row.get('surface_reelle_bati', '').strip()
-            
-            if not valeur_str or not surface_str:
-                continue
+    log(f"  - {year}: read {count} total rows")
+
+def iter_dvf_rows(url: str, year: str) -> Iterator[Tuple[str, ...]]:
+    """Read the DVF ZIP for year and yield candidate rows as DVF_COLUMNS tuples."""
+    with zipfile.ZipFile(fetch_dvf_zip(url, year)) as zip_ref:
+        # Find the .txt file in the ZIP
+        file_list = zip_ref.namelist()
+        txt_file = [f for f in file_list if f.endswith('.txt')][0]
+        
+        # Lines are read in C from a large buffer rather than by ZipExtFile.readline
+        with io.BufferedReader(zip_ref.open(txt_file), buffer_size=READ_BUFFER_SIZE) as raw_file:
+            # Map column names to their position from the header line
+            header = raw_file.readline().decode('utf-8', errors='ignore').rstrip('\r\n').split('|')
+            header_index = {name: i for i, name in enumerate(header)}
+            missing = [name for name in DVF_COLUMNS if name not in header_index]
+            if missing:
+                raise ValueError(f"{txt_file} has no column(s) {', '.join(missing)} in its header")
+            positions = [header_index[name] for name in DVF_COLUMNS]
+            select_columns = itemgetter(*positions)
+            min_width = max(positions) + 1
             
-            try:
-                valeur = float(valeur_str.replace(',', '.'))
-                surface = float(surface_str.replace(',', '.'))
-            except ValueError:
-                continue
+            # One C-level CSV reader consumes the prefiltered stream directly
+            reader = csv.reader(iter_candidate_lines(raw_file, year), delimiter='|')
+            for fields in reader:
+                if len(fields) >= min_width:
+                    yield select_columns(fields)
+
+def parse_decimal(value: str) -> Optional[float]:
+    """Convert a DVF decimal (comma separator) to float, or None if it is not a usable amount."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        number = float(value.replace(',', '.'))
+    except ValueError:
+        return None
+    # Reject nan/inf and values too large for the int64 price/surface columns
+    if not math.isfinite(number) or abs(number) >= MAX_DVF_AMOUNT:
+        return None
+    return number
+
+def process_transactions(rows: Iterable[Tuple[str, ...]], year: str) -> Transactions:
+    """Filter and process transactions for Rue Brossolette, 92400."""
+    transactions = Transactions()
+    for (code_postal, nom_voie, numero, valeur_fonciere,
+         surface_reelle_bati, date_mutation, type_local) in rows:
+        # Filter for postal code 92400 and street containing "BROSSOLETTE"
+        postal_code = code_postal.strip()
+        
+        if postal_code != '92400' or 'BROSSOLETTE' not in nom_voie:
+            continue
+        
+        # Get transaction details
+        valeur = parse_decimal(valeur_fonciere)
+        surface = parse_decimal(surface_reelle_bati)
+        
+        if valeur is None or surface is None:
+            continue
+        
+        # Calculate price per m²
+        if surface > 0:
+            price_per_m2 = valeur / surface
             
-            # Calculate price per m²
-            if surface > 0:
-                price_per_m2 = valeur / surface
-                
-                results.append({
-                    "year": year,
-                    "date": str(row.get('date_mutation', ''))[:10] if row.get('date_mutation') else None,
-                    "address": f"{row.get('adresse_numero', '')} {row.get('adresse_nom_voie', '')}, {postal_code}",
-                    "price": int(valeur),
-                    "surface_m2": int(surface),
-                    "price_per_m2": round(price_per_m2, 2),
-                    "property_type": str(row.get('type_local', '')) if row.get('type_local') else "Unknown"
-                })
-        except Exception:
+            transactions.append(
+                year=year,
+                date=date_mutation[:10] or None,
+                address=f"{numero} {nom_voie}, {postal_code}",
+                price=int(valeur),
+                surface_m2=int(surface),
+                price_per_m2=round(price_per_m2, 2),
+                property_type=type_local or "Unknown"
+            )
+    
+    return transactions
+
+def download_and_process(year: str, url: str) -> Optional[Transactions]:
+    """Fetch one DVF file and return its Brossolette transactions, or None on failure."""
+    year_clean = year.split('_')[0]  # Extract just the year
+    try:
+        # Download, parse and filter run as a single streaming pipeline
+        return process_transactions(iter_dvf_rows(url, year), year_clean)
+    except DownloadCancelled:
+        pass
+    except requests.exceptions.RequestException as e:
+        log(f"Network error downloading {year}: {e}\n"
+            f"Please try again, or visit https://www.data.gouv.fr/datasets/demandes-de-valeurs-foncieres")
+    except Exception as e:
+        log(f"Error processing {year}: {e}")
+    return None
+
+def summarize_year(year: str, prices: Iterable[float]) -> Optional[Dict]:
+    """Compute the yearly price/m² statistics in one pass, or None without prices."""
+    count = 0
+    total = low = high = 0.0
+    for price in prices:
+        if not price:
             continue
+        if count == 0:
+            low = high = price
+        elif price < low:
+            low = price
+        elif price > high:
+            high = price
+        total += price
+        count += 1
     
-    return results
+    if not count:
+        return None
+    return {
+        "year": int(year),
+        "avg_price_per_m2": round(total / count, 2),
+        "min_price_per_m2": round(low, 2),
+        "max_price_per_m2": round(high, 2),
+        "transaction_count": count
+    }
+
+def compute_yearly_stats(transactions: Transactions) -> List[Dict]:
+    """Group prices by year and compute the statistics for each year, oldest first."""
+    by_year = defaultdict(list)
+    for year, price_per_m2 in zip(transactions.year, transactions.price_per_m2):
+        by_year[year].append(price_per_m2)
+    
+    yearly_stats = []
+    for year in sorted(by_year):
+        stats = summarize_year(year, by_year[year])
+        if stats:
+            yearly_stats.append(stats)
+    return yearly_stats
 
-def generate_sample_data() -> Dict:
-    """Generate realistic sample data for demo purposes."""
+def generate_sample_data(start_year: int, end_year: int) -> Dict:
+    """Generate realistic sample data for demo purposes, for the years in the range."""
     # Base prices that increase over time (realistic market trend)
     base_prices = {
         "2020": {"avg": 5200, "variance": 800},
@@ -120,47 +337,33 @@ def generate_sample_data() -> Dict:
         "2025": {"avg": 7100, "variance": 1100},
     }
     
-    yearly_stats = []
-    all_transactions = []
+    all_transactions = Transactions()
     
     for year_str, prices_cfg in base_prices.items():
         year = int(year_str)
+        if not start_year <= year <= end_year:
+            continue
         num_transactions = random.randint(3, 8)  # 3-8 transactions per year
         
-        year_transactions = []
-        for i in range(num_transactions):
-            # Generate realistic price variations
-            noise = random.gauss(0, prices_cfg["variance"] / 3)
-            price_per_m2 = prices_cfg["avg"] + noise
-            
-            # Realistic property sizes (50-150 m²)
-            surface = random.randint(50, 150)
-            price = int(price_per_m2 * surface)
-            
-            # Random date within the year
-            date = datetime(year, 1, 1) + timedelta(days=random.randint(0, 365))
-            
-            transaction = {
-                "year": year_str,
-                "date": date.strftime("%Y-%m-%d"),
-                "address": f"{12 + i} Rue Brossolette, 92400",
-                "price": price,
-                "surface_m2": surface,
-                "price_per_m2": round(price_per_m2, 2),
-                "property_type": random.choice(["Apartment", "Studio", "2-room"])
-            }
-            year_transactions.append(transaction)
-            all_transactions.append(transaction)
+        # Draw each column for the whole year at once
+        sigma = prices_cfg["variance"] / 3
+        prices_per_m2 = [prices_cfg["avg"] + random.gauss(0, sigma) for _ in range(num_transactions)]
+        surfaces = random.choices(range(50, 151), k=num_transactions)  # Realistic property sizes (50-150 m²)
+        days = random.choices(range(366), k=num_transactions)  # Random date within the year
+        property_types = random.choices(["Apartment", "Studio", "2-room"], k=num_transactions)
         
-        # Calculate yearly statistics
-        prices = [tx["price_per_m2"] for tx in year_transactions]
-        yearly_stats.append({
-            "year": year,
-            "avg_price_per_m2": round(sum(prices) / len(prices), 2),
-            "min_price_per_m2": round(min(prices), 2),
-            "max_price_per_m2": round(max(prices), 2),
-            "transaction_count": len(prices)
-        })
+        start_date = datetime(year, 1, 1)
+        for i, (price_per_m2, surface, day, property_type) in enumerate(
+                zip(prices_per_m2, surfaces, days, property_types)):
+            all_transactions.append(
+                year=year_str,
+                date=(start_date + timedelta(days=day)).strftime("%Y-%m-%d"),
+                address=f"{12 + i} Rue Brossolette, 92400",
+                price=int(price_per_m2 * surface),
+                surface_m2=surface,
+                price_per_m2=round(price_per_m2, 2),
+                property_type=property_type
+            )
     
     return {
         "location": {
@@ -169,60 +372,70 @@ def generate_sample_data() -> Dict:
             "city": "Courbevoie",
             "department": "Hauts-de-Seine"
         },
-        "all_transactions": all_transactions,
-        "yearly_statistics": yearly_stats,
+        "all_transactions": all_transactions.to_dicts(),
+        "yearly_statistics": compute_yearly_stats(all_transactions),
         "total_transactions": len(all_transactions),
         "data_source": "Sample data (DVF real data available at https://www.data.gouv.fr)"
     }
 
 def main():
     """Main function to fetch and process DVF data."""
+    # Get year range from command line argument or use default
+    year_range = sys.argv[1] if len(sys.argv) > 1 else "2020-2025"
+    start_year, end_year = parse_year_range(year_range)
+    dvf_urls = select_dvf_urls(start_year, end_year)
+    
     print("=" * 60)
     print("Fetching DVF data for Rue Brossolette, 92400 Courbevoie")
+    print(f"Years: {start_year} to {end_year} ({len(dvf_urls)} DVF files)")
     print("=" * 60)
     
-    all_transactions = []
+    # Nothing to download: say which years exist instead of inventing data
+    if not dvf_urls:
+        dvf_years = sorted({int(year.split('_')[0]) for year in DVF_URLS})
+        print(f"⚠ No DVF file covers {start_year} to {end_year}; "
+              f"available years are {dvf_years[0]} to {dvf_years[-1]}. data.json left unchanged.")
+        sys.exit(1)
+    
+    all_transactions = Transactions()
     downloaded_any = False
     
-    # Try to download real data
-    for year, url in DVF_URLS.items():
-        rows = download_dvf_file(url, year)
-        if rows:
-            year_clean = year.split('_')[0]  # Extract just the year
-            transactions = process_transactions(rows, year_clean)
-            all_transactions.extend(transactions)
-            print(f"  ✓ Found {len(transactions)} transactions in {year}")
-            downloaded_any = True
-        else:
-            print(f"  ⚠ Skipping {year} (network issue or no data)")
+    # Try to download real data, all years in parallel
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        futures = {executor.submit(download_and_process, year, url): year for year, url in dvf_urls.items()}
+        try:
+            for future in as_completed(futures):
+                year = futures[future]
+                transactions = future.result()
+                if transactions is None:
+                    log(f"  ⚠ Skipping {year} (network issue or no data)")
+                    continue
+                results[year] = transactions
+                log(f"  ✓ Found {len(transactions)} transactions in {year}")
+                downloaded_any = True
+        except KeyboardInterrupt:
+            # Drop queued years and make running workers stop at their next
+            # chunk, otherwise leaving the executor would wait for every download
+            CANCEL_EVENT.set()
+            for future in futures:
+                future.cancel()
+            log("\n⚠ Interrupted, stopping downloads (data.json left unchanged)")
+            raise
+    
+    # Keep transactions in DVF_URLS order regardless of completion order
+    for year in dvf_urls:
+        if year in results:
+            all_transactions.extend(results[year])
     
     # If no real data was downloaded, use sample data for demo
     if not downloaded_any:
         print("\n⚠ Could not download DVF data. Using realistic sample data for demo.")
         print("To use real data, run this script again or visit:")
         print("https://www.data.gouv.fr/datasets/demandes-de-valeurs-foncieres")
-        output = generate_sample_data()
+        output = generate_sample_data(start_year, end_year)
     else:
-        # Organize by year for dashboard
-        by_year = {}
-        for tx in all_transactions:
-            year = tx['year']
-            if year not in by_year:
-                by_year[year] = []
-            by_year[year].append(tx)
-        
-        # Calculate yearly statistics
-        yearly_stats = []
-        for year in sorted(by_year.keys()):
-            prices = [tx['price_per_m2'] for tx in by_year[year] if tx['price_per_m2']]
-            if prices:
-                yearly_stats.append({
-                    "year": int(year),
-                    "avg_price_per_m2": round(sum(prices) / len(prices), 2),
-                    "min_price_per_m2": round(min(prices), 2),
-                    "max_price_per_m2": round(max(prices), 2),
-                    "transaction_count": len(prices)
-                })
+        yearly_stats = compute_yearly_stats(all_transactions)
         
         output = {
             "location": {
@@ -231,15 +444,14 @@ def main():
                 "city": "Courbevoie",
                 "department": "Hauts-de-Seine"
             },
-            "all_transactions": all_transactions,
+            "all_transactions": all_transactions.to_dicts(),
             "yearly_statistics": yearly_stats,
             "total_transactions": len(all_transactions),
             "data_source": "DVF (data.gouv.fr)"
         }
     
     # Save to JSON
-    with open('data.json', 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    save_json(output, 'data.json')
     
     print("\n" + "=" * 60)
     print(f"✓ Data saved to data.json")
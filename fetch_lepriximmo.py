@@ -5,77 +5,115 @@ Extracts actual price/m² data from the street price table.
 """
 
 import json
+import os
 import requests
-from bs4 import BeautifulSoup
-from typing import Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 from datetime import datetime
+from pathlib import Path
 import re
-import time
 import sys
 
-def parse_year_range(year_range: str) -> Tuple[int, int]:
-    """Parse year range string (e.g., '2020-2025') into tuple of integers."""
+from common import parse_year_range, save_json
+
+try:
+    import lxml  # noqa: F401  (only needed as a BeautifulSoup tree builder)
+    HTML_PARSER = 'lxml'
+except ImportError:  # Optional: C parser, falls back to the pure-Python one
+    HTML_PARSER = 'html.parser'
+
+# Years are fetched concurrently, but keep the load on lepriximmo.fr polite
+MAX_CONCURRENT_REQUESTS = 3
+
+# Shared session: keeps the connections to lepriximmo.fr alive between years
+SESSION = requests.Session()
+SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+    'Accept-Encoding': 'gzip, deflate',
+})
+_adapter = HTTPAdapter(
+    pool_maxsize=MAX_CONCURRENT_REQUESTS,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+# Price cell pattern, e.g. "5 005 €/m²" (thousands separated by regular or non-breaking spaces)
+PRICE_RE = re.compile(r'([\d\s\u00a0]+)\s*€/m²')
+
+# Prices already scraped for past years (the current year is always re-fetched)
+CACHE_FILE = Path(__file__).resolve().parent / ".lepriximmo_cache.json"
+
+# Only table rows are needed, so the rest of the page is never turned into a tree
+TABLE_ROWS = SoupStrainer('tr')
+
+def load_cache() -> Dict[str, int]:
+    """Load the price/m² of past years scraped by previous runs, keyed by year."""
     try:
-        if '-' in year_range:
-            parts = year_range.split('-')
-            if len(parts) == 2:
-                start_year = int(parts[0].strip())
-                end_year = int(parts[1].strip())
-                return start_year, end_year
-    except (ValueError, IndexError):
-        pass
-    
-    # Default to 2020-2025 if parsing fails
-    print(f"⚠ Invalid year range format '{year_range}', using default 2020-2025")
-    return 2020, 2025
+        cache = json.loads(CACHE_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    
+    # Anything but a {year: price} object counts as an empty cache
+    if not isinstance(cache, dict):
+        return {}
+    return {year: price for year, price in cache.items() if isinstance(price, int)}
+
+def save_cache(cache: Dict[str, int]) -> None:
+    """Write the past-year price cache, warning instead of failing if it cannot be saved."""
+    # Write to a temporary name and rename, so an interrupted write never
+    # leaves a truncated cache behind
+    tmp_path = CACHE_FILE.with_suffix('.tmp')
+    try:
+        save_json(cache, str(tmp_path))
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError as e:
+        print(f"⚠ Could not save cache {CACHE_FILE.name}: {e}")
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
 
 def fetch_year_data(year: int) -> Optional[int]:
     """Fetch price/m² for Rue Pierre Brossolette for a specific year."""
     
     url = f"https://www.lepriximmo.fr/prix-immobilier/ile-de-france/hauts-de-seine/courbevoie-92400/?page_voies=2&annee_voies={year}"
     
-    print(f"Fetching data for {year}...", end=" ")
-    
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=15)
+        response = SESSION.get(url, timeout=15)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Find all table rows
-        rows = soup.find_all('tr')
+        soup = BeautifulSoup(response.content, HTML_PARSER, parse_only=TABLE_ROWS)
         
-        for row in rows:
-            cells = row.find_all('td')
-            if cells:
-                # Get the first cell (street name)
-                street_name = cells[0].get_text(strip=True)
-                
-                # Check if this is Rue Pierre Brossolette or Rue Brossolette
-                if 'Brossolette' in street_name:
-                    # The price/m² should be in one of the later cells
-                    # Usually format: "5 005 €/m²" or similar
-                    for cell in cells:
-                        cell_text = cell.get_text(strip=True)
-                        # Look for pattern like "XXXX €/m²" or "X XXX €/m²"
-                        match = re.search(r'([\d\s]+)\s*€/m²', cell_text)
-                        if match:
-                            price_str = match.group(1).replace(' ', '').replace('\u00a0', '')
-                            try:
-                                price_per_m2 = int(price_str)
-                                print(f"✓ €{price_per_m2}/m²")
-                                return price_per_m2
-                            except ValueError:
-                                pass
+        for row in soup.select('tr'):
+            cells = row.select('td')
+            if not cells:
+                continue
+            
+            # Check if the first cell (street name) is Rue Pierre Brossolette or Rue Brossolette
+            if 'Brossolette' not in cells[0].get_text(strip=True):
+                continue
+            
+            # The price/m² should be in one of the later cells
+            # Usually format: "5 005 €/m²" or similar
+            for cell in cells:
+                match = PRICE_RE.search(cell.get_text(strip=True))
+                if match:
+                    price_str = ''.join(match.group(1).split())
+                    try:
+                        price_per_m2 = int(price_str)
+                        print(f"Fetching data for {year}... ✓ €{price_per_m2}/m²")
+                        return price_per_m2
+                    except ValueError:
+                        pass
         
-        print("not found")
+        print(f"Fetching data for {year}... not found")
         return None
         
     except requests.exceptions.RequestException as e:
-        print(f"error: {e}")
+        print(f"Fetching data for {year}... error: {e}")
         return None
 
 def scrape_lepriximmo(year_range: str = "2020-2025") -> Dict:
@@ -89,13 +127,30 @@ def scrape_lepriximmo(year_range: str = "2020-2025") -> Dict:
     print("=" * 60)
     print()
     
-    # Fetch data for each year in range
+    # Past years never change, so reuse prices scraped by earlier runs
+    cache = load_cache()
+    current_year = datetime.now().year
     yearly_data = {}
+    years_to_fetch = []
     for year in range(start_year, end_year + 1):
-        price = fetch_year_data(year)
-        if price:
-            yearly_data[year] = price
-        time.sleep(1)  # Be respectful with requests
+        if year < current_year and str(year) in cache:
+            yearly_data[year] = cache[str(year)]
+            print(f"Fetching data for {year}... ✓ €{yearly_data[year]}/m² (cached)")
+        else:
+            years_to_fetch.append(year)
+    
+    # Fetch the remaining years, a few at a time
+    cache_updated = False
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        for year, price in zip(years_to_fetch, executor.map(fetch_year_data, years_to_fetch)):
+            if price:
+                yearly_data[year] = price
+                if year < current_year:
+                    cache[str(year)] = price
+                    cache_updated = True
+    
+    if cache_updated:
+        save_cache(cache)
     
     print()
     
@@ -160,8 +215,7 @@ def main():
     
     if data:
         # Save to JSON
-        with open('data.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        save_json(data, 'data.json')
         
         print("=" * 60)
         print(f"✓ Data saved to data.json")